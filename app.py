@@ -13,23 +13,19 @@ Version: 1.0.0 (2025-11-21)
 """
 
 import os
+import html
 import re
-import json
+import time
+import orjson
 import streamlit as st
-from datetime import datetime
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
 # 載入環境變數
 from dotenv import load_dotenv
 load_dotenv()
 
-try:
-    from google import genai
-    from google.genai import types
-except ImportError:
-    st.error("請安裝 google-genai: pip install google-genai")
-    st.stop()
-
 # ============================================================
 # 系統指令 - 針對勞動法規 FAQ 設計
 # ============================================================
@@ -53,7 +49,7 @@ SYSTEM_INSTRUCTION = """你是勞動法規 FAQ 智慧助理，專門回答台灣
 
 ### 1. 基於資料回答
 - 你的回答必須完全基於檢索到的 FAQ 資料
-- 如果檢索結果無法回答問題，請明確告知使用者
+- 如果檢索結果無法回答問題，請明確告知使用者，並在回答開頭寫「查無相關 FAQ 資料」
 - 不要編造或猜測答案
 
 ### 2. 回答格式
@@ -137,6 +133,41 @@ SYSTEM_INSTRUCTION = """你是勞動法規 FAQ 智慧助理，專門回答台灣
 **來源：** 勞動部勞工保險局 FAQ
 """
 
+# ============================================================
+# 模組常數（正規表示式於載入時預先編譯）
+# ============================================================
+
+_DOC_ID_RE = re.compile(r'(\w+_faq_\d{8}_\d+)')
+
+# 顯示摘要時要移除的 metadata 行前綴
+_META_PREFIXES = ("來源:", "分類:", "路徑:", "問:", "答:")
+
+# 文件 ID 前綴 → 機關名稱
+_SOURCE_MAP = {
+    "mol": "勞動部",
+    "osha": "職業安全衛生署",
+    "bli": "勞動部勞工保險局"
+}
+
+# 機關名稱 → 來源圖示
+_SOURCE_ICON = {
+    "勞動部": "🏛️",
+    "職業安全衛生署": "⚠️",
+    "勞動部勞工保險局": "🛡️"
+}
+
+# 映射檔路徑（files: 文件資訊；gemini_reverse: gemini_file_id → document_id）
+_MAPPING_PATH = Path(__file__).parent / "data" / "faq_mapping.json"
+
+# 每個 session 最多快取的查詢結果數
+_FAQ_CACHE_MAX_ENTRIES = 256
+
+# 無結果查詢的快取秒數
+_NEG_CACHE_TTL = 60
+
+# 模型確認查無資料時的固定用語（見 SYSTEM_INSTRUCTION），出現時不再重試
+_NO_DATA_PHRASE = "查無相關 FAQ 資料"
+
 # ============================================================
 # Gemini 初始化
 # ============================================================
@@ -148,6 +179,12 @@ def init_gemini():
     if not api_key:
         return None, "未設定 GEMINI_API_KEY"
 
+    # 延遲載入 google-genai，避免每次 rerun 都執行匯入
+    try:
+        from google import genai
+    except ImportError:
+        return None, "請安裝 google-genai: pip install google-genai"
+
     try:
         client = genai.Client(api_key=api_key)
         return client, None
@@ -156,35 +193,51 @@ def init_gemini():
 
 
 @st.cache_data
-def load_file_mapping():
-    """載入 FAQ 檔案映射（包含原始連結）"""
-    mapping_path = Path(__file__).parent / "data" / "faq_file_mapping.json"
-    if mapping_path.exists():
-        with open(mapping_path, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-            return data.get('files', {})
+def load_faq_mapping():
+    """載入合併後的 FAQ 映射檔（files 與 gemini_reverse）"""
+    if _MAPPING_PATH.exists():
+        with open(_MAPPING_PATH, 'rb') as f:
+            return orjson.loads(f.read())
     return {}
 
 
-@st.cache_data
-def load_gemini_id_mapping():
-    """載入 Gemini ID 映射（gemini_file_id → document_id）"""
-    mapping_path = Path(__file__).parent / "data" / "faq_gemini_id_mapping.json"
-    if mapping_path.exists():
-        with open(mapping_path, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-            files = data.get('files', {})
-            # 建立反向映射: gemini_file_id → document_id
-            reverse_map = {}
-            for doc_id, info in files.items():
-                gemini_id = info.get('gemini_file_id', '')
-                if gemini_id:
-                    reverse_map[gemini_id] = doc_id
-            return reverse_map
-    return {}
+def _load_all_mappings():
+    """一次取得 (file_mapping, gemini_id_mapping)，只查詢一次 Streamlit 快取"""
+    data = load_faq_mapping()
+    return data.get('files', {}), data.get('gemini_reverse', {})
+
+
+@st.cache_resource
+def build_generate_config(store_id: str):
+    """建立查詢用的 GenerateContentConfig（每個 store 只建立一次）"""
+    from google.genai import types
 
+    return types.GenerateContentConfig(
+        system_instruction=SYSTEM_INSTRUCTION,
+        tools=[
+            types.Tool(
+                file_search=types.FileSearch(
+                    file_search_store_names=[store_id]
+                )
+            )
+        ],
+        temperature=0.3,
+    )
+
+
+def _build_source_info(rc) -> dict:
+    """由 retrieved_context 建立來源資訊；內容只截斷一次，去重鍵一併預先計算"""
+    # 保留 400 字供顯示摘要（300 字）使用
+    text = (getattr(rc, 'text', '') or '')[:400]
+    return {
+        "title": getattr(rc, 'title', ''),
+        "uri": getattr(rc, 'uri', ''),
+        "text": text,
+        "_dedup_key": text[:100]
+    }
 
-def query_faq(client, query: str, store_id: str) -> dict:
+
+def query_faq(client, query: str, store_id: str, config=None) -> dict:
     """
     執行 FAQ 查詢
 
@@ -192,26 +245,21 @@ def query_faq(client, query: str, store_id: str) -> dict:
         client: Gemini client
         query: 使用者查詢
         store_id: File Search Store ID
+        config: 預先建立的 GenerateContentConfig（背景執行緒使用，
+            避免在無 ScriptRunContext 下呼叫 Streamlit 快取）
 
     Returns:
         dict: 包含 response, sources, metadata
     """
     try:
+        if config is None:
+            config = build_generate_config(store_id)
+
         # 使用 File Search 進行 RAG 查詢
         response = client.models.generate_content(
             model="gemini-2.5-flash",
             contents=query,
-            config=types.GenerateContentConfig(
-                system_instruction=SYSTEM_INSTRUCTION,
-                tools=[
-                    types.Tool(
-                        file_search=types.FileSearch(
-                            file_search_store_names=[store_id]
-                        )
-                    )
-                ],
-                temperature=0.3,
-            )
+            config=config
         )
 
         # 解析回應
@@ -220,25 +268,24 @@ def query_faq(client, query: str, store_id: str) -> dict:
             "sources": [],
             "metadata": {
                 "model": "gemini-2.5-flash",
-                "timestamp": datetime.now().isoformat()
+                # Unix 時間戳；介面未顯示，需要時再格式化
+                "timestamp": time.time()
             }
         }
 
         # 提取來源資訊
-        if hasattr(response, 'candidates') and response.candidates:
-            for candidate in response.candidates:
-                if hasattr(candidate, 'grounding_metadata') and candidate.grounding_metadata:
-                    gm = candidate.grounding_metadata
-                    if hasattr(gm, 'grounding_chunks') and gm.grounding_chunks:
-                        for chunk in gm.grounding_chunks:
-                            if hasattr(chunk, 'retrieved_context'):
-                                rc = chunk.retrieved_context
-                                source_info = {
-                                    "title": getattr(rc, 'title', ''),
-                                    "uri": getattr(rc, 'uri', ''),
-                                    "text": getattr(rc, 'text', '')[:200] if hasattr(rc, 'text') else ''
-                                }
-                                result["sources"].append(source_info)
+        sources = []
+        for candidate in getattr(response, 'candidates', None) or ():
+            gm = getattr(candidate, 'grounding_metadata', None)
+            chunks = getattr(gm, 'grounding_chunks', None) if gm else None
+            if not chunks:
+                continue
+            sources.extend(
+                _build_source_info(rc)
+                for rc in (getattr(chunk, 'retrieved_context', None) for chunk in chunks)
+                if rc
+            )
+        result["sources"] = sources
 
         return result
 
@@ -251,24 +298,113 @@ def query_faq(client, query: str, store_id: str) -> dict:
         }
 
 
-def parse_source_info(title: str, text: str = "", file_mapping: dict = None, gemini_id_mapping: dict = None) -> dict:
+def cached_query_faq(client, query: str, store_id: str) -> dict:
+    """
+    帶快取的 FAQ 查詢（每個 session 一份 LRU 快取）
+
+    僅快取成功且有來源的結果，失敗或無來源的結果仍會走重試流程。
+
+    Args:
+        client: Gemini client
+        query: 使用者查詢
+        store_id: File Search Store ID
+
+    Returns:
+        dict: 同 query_faq
+    """
+    cache = st.session_state.setdefault("_faq_cache", OrderedDict())
+    key = (query, store_id)
+    if key in cache:
+        cache.move_to_end(key)
+        return cache[key]
+
+    result = None
+    future = st.session_state.get("_prefetch", {}).pop(key, None)
+    if future is not None:
+        # 預查詢已在進行中，等待它比重新發送請求更快
+        try:
+            result = future.result()
+        except Exception:
+            result = None
+    if result is None:
+        result = query_faq(client, query, store_id)
+
+    if not result.get("error") and result.get("sources"):
+        cache[key] = result
+        if len(cache) > _FAQ_CACHE_MAX_ENTRIES:
+            cache.popitem(last=False)
+    return result
+
+
+def prefetch_quick_queries(client, queries: list, store_id: str):
+    """
+    背景預先查詢快速查詢按鈕的問題
+
+    結果以 future 存於 st.session_state["_prefetch"]，由 cached_query_faq 取用。
+    每個 session 只執行一次。
+
+    Args:
+        client: Gemini client
+        queries: 查詢問題列表
+        store_id: File Search Store ID
+    """
+    if "_prefetch" in st.session_state:
+        return
+
+    # 在主執行緒建立 config，背景執行緒不再呼叫 st.cache_resource
+    config = build_generate_config(store_id)
+
+    executor = ThreadPoolExecutor(max_workers=3)
+    st.session_state["_prefetch"] = {
+        (q, store_id): executor.submit(query_faq, client, q, store_id, config)
+        for q in queries
+    }
+    # 不等待完成；已提交的查詢仍會在背景執行
+    executor.shutdown(wait=False)
+
+
+def _extract_field(text: str, key: str) -> str:
+    """取出 `key:` 之後的單行內容（取代正規表示式以減少開銷）"""
+    _, sep, rest = text.partition(key + ":")
+    if not sep:
+        return ""
+    line, _, _ = rest.lstrip().partition("\n")
+    return line.strip()
+
+
+def _extract_question(text: str) -> str:
+    """取出 `問:` 之後、換行或 `答:` 之前的問題內容"""
+    start = text.find("問:")
+    if start < 0:
+        return ""
+    rest = text[start + 2:].lstrip()
+    end = len(rest)
+    for stop in ("\n", "答:"):
+        pos = rest.find(stop)
+        if 0 <= pos < end:
+            end = pos
+    return rest[:end].strip()
+
+
+def parse_source_info(title: str, text: str = "") -> dict:
     """
     解析來源資訊
 
     Args:
         title: 檔案名稱 (可能是 Gemini file ID 或檔名)
         text: 內容片段（可從中提取來源和問題）
-        file_mapping: 檔案映射（包含原始連結）
-        gemini_id_mapping: Gemini ID 反向映射（gemini_file_id → document_id）
 
     Returns:
-        dict: 包含 source, question, display_name, detail_url
+        dict: 包含 source, question, category, display_name, detail_url
     """
-    source_map = {
-        "mol": "勞動部",
-        "osha": "職業安全衛生署",
-        "bli": "勞動部勞工保險局"
-    }
+    # 同一份 FAQ 在不同查詢間經常重複出現，以 (title, 前 200 字) 作為快取鍵
+    return _parse_source_info_cached(title, text[:200] if text else "")
+
+
+@st.cache_data(max_entries=2048, show_spinner=False)
+def _parse_source_info_cached(title: str, text: str) -> dict:
+    """parse_source_info 的快取實作（st.cache_data 跨 rerun 保留，且每次回傳副本）"""
+    file_mapping, gemini_id_mapping = _load_all_mappings()
 
     source_name = ""
     question = ""
@@ -277,8 +413,7 @@ def parse_source_info(title: str, text: str = "", file_mapping: dict = None, gem
     doc_id = ""
 
     # 嘗試從檔名提取 document ID
-    pattern = r'(\w+_faq_\d{8}_\d+)'
-    match = re.search(pattern, title.replace('.txt', ''))
+    match = _DOC_ID_RE.search(title.replace('.txt', ''))
     if match:
         doc_id = match.group(1)
 
@@ -298,19 +433,15 @@ def parse_source_info(title: str, text: str = "", file_mapping: dict = None, gem
     # 優先從內容中提取來源和問題
     if text:
         # 提取來源
-        source_match = re.search(r'來源:\s*(.+?)(?:\n|$)', text)
-        if source_match:
-            source_name = source_match.group(1).strip()
+        source_name = _extract_field(text, "來源") or source_name
 
         # 提取分類
-        category_match = re.search(r'分類:\s*(.+?)(?:\n|$)', text)
-        if category_match:
-            category = category_match.group(1).strip()
+        category = _extract_field(text, "分類")
 
         # 提取問題
-        question_match = re.search(r'問:\s*(.+?)(?:\n|答:|$)', text, re.DOTALL)
-        if question_match:
-            question = question_match.group(1).strip()
+        text_question = _extract_question(text)
+        if text_question:
+            question = text_question
             # 截斷過長的問題
             if len(question) > 50:
                 question = question[:50] + "..."
@@ -318,7 +449,7 @@ def parse_source_info(title: str, text: str = "", file_mapping: dict = None, gem
     # 如果從內容提取失敗，嘗試從檔名解析來源
     if not source_name and doc_id:
         source_code = doc_id.split('_')[0].lower()
-        source_name = source_map.get(source_code, source_code.upper())
+        source_name = _SOURCE_MAP.get(source_code, source_code.upper())
 
     # 建立顯示名稱
     if question:
@@ -344,64 +475,77 @@ def display_sources(sources: list):
     if not sources:
         return
 
-    # 載入檔案映射
-    file_mapping = load_file_mapping()
-    gemini_id_mapping = load_gemini_id_mapping()
-
-    # 去重（使用內容片段去重）
-    seen = set()
-    unique_sources = []
+    # 去重（使用內容片段去重，dict 保留插入順序），最多顯示 10 筆
+    seen = {}
     for s in sources:
-        text = s.get('text', '')
-        key = text[:100] if text else s.get('title', '')
+        key = s.get('_dedup_key') or s.get('title', '')
         if key and key not in seen:
-            seen.add(key)
-            unique_sources.append(s)
+            seen[key] = s
+    unique_sources = list(seen.values())[:10]
 
     if not unique_sources:
         return
 
-    st.markdown("---")
-    st.markdown(f"**📚 參考來源** ({len(unique_sources)} 筆)")
+    # 所有來源組成單一 markdown（HTML <details> 折疊），只送出一個元件
+    parts = ["---", f"**📚 參考來源** ({len(unique_sources)} 筆)"]
 
-    for i, source in enumerate(unique_sources[:10], 1):
+    for i, source in enumerate(unique_sources, 1):
         title = source.get('title', '未知')
         text = source.get('text', '')
-        info = parse_source_info(title, text, file_mapping, gemini_id_mapping)
+        info = parse_source_info(title, text)
 
         # 來源圖示
-        source_icon = {
-            "勞動部": "🏛️",
-            "職業安全衛生署": "⚠️",
-            "勞動部勞工保險局": "🛡️"
-        }.get(info['source'], "📄")
-
-        with st.expander(f"{i}. {source_icon} {info['display_name']}", expanded=False):
-            # 顯示來源機關
-            if info['source'] and info['source'] != "未知來源":
-                st.caption(f"來源：{info['source']}")
-
-            # 顯示分類
-            if info.get('category'):
-                st.caption(f"分類：{info['category']}")
-
-            # 顯示原始連結
-            if info.get('detail_url'):
-                st.markdown(f"🔗 [查看原始頁面]({info['detail_url']})")
-
-            # 顯示內容摘要
-            if text:
-                # 清理內容，移除 metadata 部分
-                clean_text = re.sub(r'^(來源|分類|路徑|問|答):.+?\n', '', text, flags=re.MULTILINE)
-                clean_text = clean_text.strip()
-                if clean_text:
-                    st.markdown(f"> {clean_text[:300]}{'...' if len(clean_text) > 300 else ''}")
+        source_icon = _SOURCE_ICON.get(info['source'], "📄")
+
+        details = []
+
+        # 顯示來源機關
+        if info['source'] and info['source'] != "未知來源":
+            details.append(f"來源：{html.escape(info['source'])}")
+
+        # 顯示分類
+        if info.get('category'):
+            details.append(f"分類：{html.escape(info['category'])}")
+
+        # 顯示原始連結
+        if info.get('detail_url'):
+            details.append(f"🔗 [查看原始頁面]({info['detail_url']})")
+
+        body = "  \n".join(details)
+
+        # 顯示內容摘要
+        if text:
+            # 清理內容，移除 metadata 部分
+            clean_text = "\n".join(
+                line for line in text.splitlines()
+                if not line.startswith(_META_PREFIXES)
+            ).strip()
+            if clean_text:
+                summary = f"{clean_text[:300]}{'...' if len(clean_text) > 300 else ''}"
+                body += f"\n\n> {html.escape(summary)}"
+
+        parts.append(
+            f"<details><summary>{i}. {source_icon} {html.escape(info['display_name'])}</summary>\n\n"
+            f"{body}\n\n</details>"
+        )
+
+    st.markdown("\n\n".join(parts), unsafe_allow_html=True)
 
 
 # ============================================================
 # Streamlit UI
 # ============================================================
 
+def show_no_results():
+    """顯示查無相關結果的提示"""
+    st.warning("您查詢的問題在目前的 FAQ 資料庫中沒有直接相關的結果。建議：")
+    st.markdown("""
+    - 嘗試使用不同的關鍵字
+    - 將問題拆分成更具體的小問題
+    - 直接洽詢勞動部、職業安全衛生署或勞工保險局
+    """)
+
+
 def main():
     st.set_page_config(
         page_title="勞動法規 FAQ 查詢",
@@ -422,6 +566,18 @@ def main():
     # Store ID (從環境變數或預設值)
     store_id = os.getenv("FILE_SEARCH_STORE_ID", "fileSearchStores/laborfaq-ich1zaoo2nmw")
 
+    quick_queries = [
+        ("加班費計算", "加班費怎麼計算？"),
+        ("特休天數", "特別休假有幾天？怎麼計算？"),
+        ("勞保老年給付", "勞保老年給付怎麼領？"),
+        ("資遣費計算", "資遣費怎麼計算？"),
+        ("職災補償", "發生職業災害可以申請哪些補償？"),
+        ("育嬰留停", "育嬰留職停薪怎麼申請？津貼怎麼領？"),
+    ]
+
+    # 預先查詢快速查詢問題，點擊時可直接取用結果
+    prefetch_quick_queries(client, [q for _, q in quick_queries], store_id)
+
     # 警告提示
     with st.expander("注意事項", expanded=False):
         st.warning("""
@@ -435,15 +591,6 @@ def main():
     # 快速查詢按鈕
     st.markdown("**🚀 快速查詢：**")
 
-    quick_queries = [
-        ("加班費計算", "加班費怎麼計算？"),
-        ("特休天數", "特別休假有幾天？怎麼計算？"),
-        ("勞保老年給付", "勞保老年給付怎麼領？"),
-        ("資遣費計算", "資遣費怎麼計算？"),
-        ("職災補償", "發生職業災害可以申請哪些補償？"),
-        ("育嬰留停", "育嬰留職停薪怎麼申請？津貼怎麼領？"),
-    ]
-
     cols = st.columns(3)
     selected_query = None
     for idx, (label, q) in enumerate(quick_queries):
@@ -464,8 +611,17 @@ def main():
             st.warning("請輸入查詢問題")
             return
 
+        # 近期已確認無結果的查詢，不再重複呼叫 API
+        neg_cache = st.session_state.setdefault("_neg_cache", {})
+        cache_key = (query, store_id)
+        if cache_key in neg_cache:
+            if time.time() - neg_cache[cache_key] < _NEG_CACHE_TTL:
+                show_no_results()
+                return
+            del neg_cache[cache_key]
+
         with st.spinner("查詢中..."):
-            result = query_faq(client, query, store_id)
+            result = cached_query_faq(client, query, store_id)
 
         if result.get("error"):
             st.error(f"查詢失敗: {result['error']}")
@@ -479,22 +635,25 @@ def main():
             st.warning("未能找到相關資料，請嘗試調整查詢內容。")
             return
 
-        # 如果沒有來源，可能需要重試
+        # 如果沒有來源，可能需要重試（模型已明確表示查無資料時不重試）
         if not sources:
-            st.info("正在重新檢索...")
-            with st.spinner("重試中..."):
-                result = query_faq(client, query, store_id)
+            if _NO_DATA_PHRASE not in response:
+                st.info("正在重新檢索...")
+                with st.spinner("重試中..."):
+                    result = cached_query_faq(client, query, store_id)
 
-            response = result.get("response", "")
-            sources = result.get("sources", [])
+                response = result.get("response", "")
+                sources = result.get("sources", [])
 
             if not sources:
-                st.warning("您查詢的問題在目前的 FAQ 資料庫中沒有直接相關的結果。建議：")
-                st.markdown("""
-                - 嘗試使用不同的關鍵字
-                - 將問題拆分成更具體的小問題
-                - 直接洽詢勞動部、職業安全衛生署或勞工保險局
-                """)
+                # 只快取模型明確表示查無資料的結果；一般檢索失誤下次仍會重新查詢
+                if _NO_DATA_PHRASE in response:
+                    # 寫入時順便清除已過期的項目
+                    now = time.time()
+                    for key in [k for k, ts in neg_cache.items() if now - ts >= _NEG_CACHE_TTL]:
+                        del neg_cache[key]
+                    neg_cache[cache_key] = now
+                show_no_results()
                 return
 
         # 顯示回答